@@ -21,7 +21,6 @@
 
 from __future__ import annotations
 
-import asyncio
 from datetime import datetime
 from typing import (
     overload, Optional, Union, List, TYPE_CHECKING, TypeVar, Dict, Any, runtime_checkable, Protocol, Tuple
@@ -406,7 +405,7 @@ class GuildChannel:
                 d.update(parent_id=parent_id)
             payload.append(d)
 
-        await asyncio.gather(*http.bulk_channel_update(self.guild.id, payload, reason=reason))
+        await http.bulk_channel_update(self.guild.id, payload, reason=reason)
 
     async def _edit(self, options: Dict[str, Any], reason: Optional[str]) -> Optional[ChannelPayload]:
         try:
@@ -468,7 +467,7 @@ class GuildChannel:
         obj = cls(state=self._state, guild=self.guild, data=data)
 
         # temporarily add it to the cache
-        self.guild._channels[obj.id] = obj  # type: ignore
+        self.guild._add_channel(obj)  # type: ignore
         return obj
 
     async def clone(self: GCH, *, name: Optional[str] = None, reason: Optional[str] = None) -> GCH:
@@ -606,7 +605,7 @@ class GuildChannel:
                 d.update(parent_id=parent_id)
             payload.append(d)
 
-        await asyncio.gather(*self._state.http.bulk_channel_update(self.guild.id, payload))
+        await self._state.http.bulk_channel_update(self.guild.id, payload)
 
 
 class BaseAudioControl:
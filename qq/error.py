@@ -27,12 +27,7 @@ if TYPE_CHECKING:
     from .http import Route
     from aiohttp import ClientResponse, ClientWebSocketResponse
 
-    try:
-        from requests import Response
-
-        _ResponseType = Union[ClientResponse, Response]
-    except ModuleNotFoundError:
-        _ResponseType = ClientResponse
+    _ResponseType = ClientResponse
 
 __all__ = (
     'QQException',
@@ -103,7 +98,6 @@ class HTTPException(QQException):
     response: :class:`aiohttp.ClientResponse`
         失败的 HTTP 请求的响应。
         这是 :class:`aiohttp.ClientResponse` 的一个实例。
-        在某些情况下，这也可能是一个 :class:`requests.Response`。
     text: :class:`str`
         错误的文本。可能是一个空字符串。
     status: :class:`int`
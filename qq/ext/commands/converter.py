@@ -592,7 +592,7 @@ class RoleConverter(IDConverter[qq.Role]):
         if match:
             result = guild.get_role(int(match.group(1)))
         else:
-            result = qq.utils.get(guild._roles.values(), name=argument)
+            result = qq.utils.get(guild._inflate_roles().values(), name=argument)
 
         if result is None:
             raise RoleNotFound(argument)
@@ -21,6 +21,8 @@
 
 from __future__ import annotations
 
+import functools
+import operator
 from typing import Type, Optional, Any, TypeVar, Callable, overload, Iterator, Tuple, ClassVar, Dict
 
 __all__ = (
@@ -71,8 +73,7 @@ def fill_with_flags(*, inverted: bool = False):
         # fmt: on
 
         if inverted:
-            max_bits = max(cls.VALID_FLAGS.values()).bit_length()
-            cls.DEFAULT_VALUE = -1 + (2 ** max_bits)
+            cls.DEFAULT_VALUE = functools.reduce(operator.or_, cls.VALID_FLAGS.values(), 0)
         else:
             cls.DEFAULT_VALUE = 0
 
@@ -20,24 +20,29 @@
 #  DEALINGS IN THE SOFTWARE.
 
 import asyncio
-import concurrent
 import inspect
 import logging
 import sys
-import threading
 import time
-import traceback
 import zlib
-from collections import namedtuple
+from collections import deque
 
 import aiohttp
 
 from qq import utils
 from qq.error import ConnectionClosed
 
-EventListener = namedtuple('EventListener', 'predicate event result future')
 _log = logging.getLogger(__name__)
 
+_PROPERTIES = {
+    '$os': sys.platform,
+    '$browser': 'qq.py',
+    '$device': 'qq.py',
+}
+_ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+# compressed frames larger than this are inflated in the default executor
+_INFLATE_EXECUTOR_THRESHOLD = 65536
+
 __all__ = (
     'QQWebSocket',
     'KeepAliveHandler',
@@ -46,6 +51,16 @@ __all__ = (
 )
 
 
+class EventListener:
+    __slots__ = ('predicate', 'event', 'result', 'future')
+
+    def __init__(self, *, predicate, event, result, future):
+        self.predicate = predicate
+        self.event = event
+        self.result = result
+        self.future = future
+
+
 class QQClientWebSocketResponse(aiohttp.ClientWebSocketResponse):
     async def close(self, *, code: int = 4000, message: bytes = b'') -> bool:
         return await super().close(code=code, message=message)
@@ -65,69 +80,71 @@ class ReconnectWebSocket(Exception):
         self.op = 'RESUME' if resume else 'IDENTIFY'
 
 
-class KeepAliveHandler(threading.Thread):
-    def __init__(self, *args, **kwargs):
-        ws = kwargs.pop('ws', None)
-        interval = kwargs.pop('interval', None)
-        shard_id = kwargs.pop('shard_id', None)
-        threading.Thread.__init__(self, *args, **kwargs)
+class KeepAliveHandler:
+    def __init__(self, *, ws, interval=None, shard_id=None):
         self.ws = ws
-        self._main_thread_id = ws.thread_id
         self.interval = interval
-        self.daemon = True
         self.shard_id = shard_id
         self.msg = '使用序列 %s 保持分片 ID %s websocket 处于活动状态。'
         self.block_msg = '分片 ID %s 心跳被阻止超过 %s 秒。'
         self.behind_msg = '跟不上，分片 ID %s websocket 落后 %.1fs。'
-        self._stop_ev = threading.Event()
+        self._stopped = False
+        self._handle = None
+        self._close_task = None
+        self._pending_heartbeat = None
+        self._heartbeat_pending_since = 0.0
         self._last_ack = time.perf_counter()
         self._last_send = time.perf_counter()
         self._last_recv = time.perf_counter()
         self.latency = float('inf')
         self.heartbeat_timeout = ws._max_heartbeat_timeout
 
-    def run(self):
-        while not self._stop_ev.wait(self.interval):
-            if self._last_recv + self.heartbeat_timeout < time.perf_counter():
-                _log.warning("分片 ID %s 已停止响应 websocket 。关闭并重新启动。",
-                             self.shard_id)
-                coro = self.ws.close(4000)
-                f = asyncio.run_coroutine_threadsafe(coro, loop=self.ws.loop)
-
-                try:
-                    f.result()
-                except Exception:
-                    _log.exception('停止 websocket 时发生错误。无视。')
-                finally:
-                    self.stop()
-                    return
+    def start(self):
+        self._handle = self.ws.loop.call_later(self.interval, self._beat)
+
+    def _beat(self):
+        self._handle = None
+        if self._stopped:
+            return
+
+        loop = self.ws.loop
+        if self._last_recv + self.heartbeat_timeout < time.perf_counter():
+            _log.warning("分片 ID %s 已停止响应 websocket 。关闭并重新启动。",
+                         self.shard_id)
+            self.stop()
+            self._close_task = loop.create_task(self._close())
+            return
 
+        pending = self._pending_heartbeat
+        if pending is not None and not pending.done():
+            total = time.perf_counter() - self._heartbeat_pending_since
+            _log.warning(self.block_msg, self.shard_id, round(total, 1))
+        else:
             data = self.get_payload()
             _log.debug(self.msg, data['d'], self.shard_id)
-            coro = self.ws.send_heartbeat(data)
-            f = asyncio.run_coroutine_threadsafe(coro, loop=self.ws.loop)
-            try:
-                # block until sending is complete
-                total = 0
-                while True:
-                    try:
-                        f.result(10)
-                        break
-                    except concurrent.futures.TimeoutError:
-                        total += 10
-                        try:
-                            frame = sys._current_frames()[self._main_thread_id]
-                        except KeyError:
-                            msg = self.block_msg
-                        else:
-                            stack = ''.join(traceback.format_stack(frame))
-                            msg = f'{self.block_msg}\nLoop 线程回溯（最近一次调用）：\n{stack}'
-                        _log.warning(msg, self.shard_id, total)
-
-            except Exception:
-                self.stop()
-            else:
-                self._last_send = time.perf_counter()
+            self._heartbeat_pending_since = time.perf_counter()
+            self._pending_heartbeat = fut = loop.create_task(self.ws.send_heartbeat(data))
+            fut.add_done_callback(self._heartbeat_done)
+
+        self._handle = loop.call_later(self.interval, self._beat)
+
+    async def _close(self):
+        try:
+            await self.ws.close(4000)
+        except Exception:
+            _log.exception('停止 websocket 时发生错误。无视。')
+
+    def _heartbeat_done(self, fut):
+        self._pending_heartbeat = None
+        # also retrieves the exception so it isn't reported as never retrieved
+        failed = fut.cancelled() or fut.exception() is not None
+        if self._stopped:
+            # the websocket is being torn down, leave it alone
+            return
+        if failed:
+            self.stop()
+        else:
+            self._last_send = time.perf_counter()
 
     def get_payload(self):
         return {
@@ -136,7 +153,15 @@ class KeepAliveHandler(threading.Thread):
         }
 
     def stop(self):
-        self._stop_ev.set()
+        self._stopped = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        # an in-flight send must not outlive the handler either
+        pending = self._pending_heartbeat
+        if pending is not None:
+            pending.cancel()
+            self._pending_heartbeat = None
 
     def tick(self):
         self._last_recv = time.perf_counter()
@@ -153,42 +178,44 @@ class GatewayRatelimiter:
     def __init__(self, count=110, per=60.0):
         # The default is 110 to give room for at least 10 heartbeats per minute
         self.max = count
-        self.remaining = count
-        self.window = 0.0
         self.per = per
-        self.lock = asyncio.Lock()
+        # send timestamps within the sliding window, oldest first
+        self._hits = deque(maxlen=count)
+        # created on first use so that it binds to the running loop
+        self.lock = None
         self.shard_id = None
 
+    def _prune(self, current):
+        hits = self._hits
+        cutoff = current - self.per
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+
     def is_ratelimited(self):
-        current = time.time()
-        if current > self.window + self.per:
-            return False
-        return self.remaining == 0
+        self._prune(time.monotonic())
+        return len(self._hits) >= self.max
 
     def get_delay(self):
-        current = time.time()
-
-        if current > self.window + self.per:
-            self.remaining = self.max
-
-        if self.remaining == self.max:
-            self.window = current
+        current = time.monotonic()
+        self._prune(current)
 
-        if self.remaining == 0:
-            return self.per - (current - self.window)
-
-        self.remaining -= 1
-        if self.remaining == 0:
-            self.window = current
+        if len(self._hits) >= self.max:
+            return self._hits[0] + self.per - current
 
+        self._hits.append(current)
         return 0.0
 
     async def block(self):
-        async with self.lock:
-            delta = self.get_delay()
-            if delta:
-                _log.warning('分片 ID %s 中的 WebSocket 受速率限制，等待 %.2f 秒', self.shard_id, delta)
-                await asyncio.sleep(delta)
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        while True:
+            async with self.lock:
+                delta = self.get_delay()
+            if not delta:
+                return
+            _log.warning('分片 ID %s 中的 WebSocket 受速率限制，等待 %.2f 秒', self.shard_id, delta)
+            await asyncio.sleep(delta)
 
 
 class QQWebSocket:
@@ -209,22 +236,31 @@ class QQWebSocket:
     def __init__(self, socket, *, loop):
         self.socket = socket
         self.loop = loop
+        self._to_json = utils._to_json
+        self._from_json = utils._from_json
 
         # an empty dispatcher to prevent crashes
         self._dispatch = lambda *args: None
-        # generic event listeners
-        self._dispatch_listeners = []
+        self._enable_debug_events = False
+        # generic event listeners, keyed by event name
+        self._dispatch_listeners = {}
         # the keep alive
         self._keep_alive = None
-        self.thread_id = threading.get_ident()
 
         # ws related stuff
         self.session_id = None
         self.sequence = None
         self._zlib = zlib.decompressobj()
-        self._buffer = bytearray()
+        self._inflated = bytearray()
         self._close_code = None
         self._rate_limiter = GatewayRatelimiter()
+        self._op_handlers = {
+            self.RECONNECT: self._on_reconnect,
+            self.HEARTBEAT_ACK: self._on_heartbeat_ack,
+            self.HEARTBEAT: self._on_heartbeat,
+            self.HELLO: self._on_hello,
+            self.INVALIDATE_SESSION: self._on_invalidate_session,
+        }
 
     @property
     def open(self):
@@ -234,11 +270,10 @@ class QQWebSocket:
         return self._rate_limiter.is_ratelimited()
 
     def debug_log_receive(self, data, /):
+        if not isinstance(data, str):
+            data = data.decode('utf-8')
         self._dispatch('socket_raw_receive', data)
 
-    def log_receive(self, _, /):
-        pass
-
     @classmethod
     async def from_client(cls, client, *, initial=False, gateway=None, shard_id=None, session=None, sequence=None,
                           resume=False):
@@ -251,6 +286,7 @@ class QQWebSocket:
 
         # dynamically add attributes needed
         ws.token = client.http.token
+        ws._bot_token = f'Bot {ws.token}'
         ws._connection = client._connection
         ws._qq_parsers = client._connection.parsers
         ws._dispatch = client.dispatch
@@ -264,9 +300,9 @@ class QQWebSocket:
         ws.sequence = sequence
         ws._max_heartbeat_timeout = client._connection.heartbeat_timeout
 
+        ws._enable_debug_events = client._enable_debug_events
         if client._enable_debug_events:
             ws.send = ws.debug_send
-            ws.log_receive = ws.debug_log_receive
 
         _log.debug('创建连接到 %s 的 websocket', gateway)
 
@@ -300,7 +336,7 @@ class QQWebSocket:
 
         future = self.loop.create_future()
         entry = EventListener(event=event, predicate=predicate, result=result, future=future)
-        self._dispatch_listeners.append(entry)
+        self._dispatch_listeners.setdefault(event, []).append(entry)
         return future
 
     async def identify(self):
@@ -308,12 +344,8 @@ class QQWebSocket:
         payload = {
             'op': self.IDENTIFY,
             'd': {
-                'token': 'Bot ' + self.token,
-                'properties': {
-                    '$os': sys.platform,
-                    '$browser': 'qq.py',
-                    '$device': 'qq.py',
-                },
+                'token': self._bot_token,
+                'properties': _PROPERTIES,
             }
         }
 
@@ -335,84 +367,107 @@ class QQWebSocket:
             'd': {
                 'seq': self.sequence,
                 'session_id': self.session_id,
-                'token': 'Bot ' + self.token
+                'token': self._bot_token
             }
         }
 
         await self.send_as_json(payload)
         _log.info('分片 ID %s 已发送 RESUME 负载。', self.shard_id)
 
+    async def _on_reconnect(self, data):
+        # "reconnect" can only be handled by the Client
+        # so we terminate our connection and raise an
+        # internal exception signalling to reconnect.
+        _log.debug('收到 RECONNECT 操作码。')
+        await self.close()
+        raise ReconnectWebSocket(self.shard_id)
+
+    async def _on_heartbeat_ack(self, data):
+        if self._keep_alive:
+            self._keep_alive.ack()
+
+    async def _on_heartbeat(self, data):
+        if self._keep_alive:
+            beat = self._keep_alive.get_payload()
+            await self.send_as_json(beat)
+
+    async def _on_hello(self, data):
+        interval = data['heartbeat_interval'] / 1000.0
+        self._keep_alive = KeepAliveHandler(ws=self, interval=interval, shard_id=self.shard_id)
+        # send a heartbeat immediately
+        self._keep_alive.start()
+
+    async def _on_invalidate_session(self, data):
+        if data is True:
+            await self.close()
+            raise ReconnectWebSocket(self.shard_id)
+
+        self.sequence = None
+        self.session_id = None
+        _log.info('分片 ID %s 会话已失效。', self.shard_id)
+        await self.close(code=1000)
+        raise ReconnectWebSocket(self.shard_id, resume=False)
+
     async def received_message(self, msg, /):
         if type(msg) is bytes:
-            self._buffer.extend(msg)
+            # inflate each fragment as it arrives so the compressed frames
+            # never have to be buffered in full
+            if len(msg) > _INFLATE_EXECUTOR_THRESHOLD:
+                # zlib releases the GIL, keep large frames off the event loop
+                # only one message is in flight per shard, so the decompressor is not shared
+                inflated = await self.loop.run_in_executor(None, self._zlib.decompress, msg)
+            else:
+                inflated = self._zlib.decompress(msg)
 
-            if len(msg) < 4 or msg[-4:] != b'\x00\x00\xff\xff':
+            buffer = self._inflated
+            if not msg.endswith(_ZLIB_SUFFIX):
+                buffer += inflated
                 return
-            msg = self._zlib.decompress(self._buffer)
-            msg = msg.decode('utf-8')
-            self._buffer = bytearray()
-
-        self.log_receive(msg)
-        msg = utils._from_json(msg)
 
-        _log.debug('分片 ID %s：WebSocket 事件：%s', self.shard_id, msg)
-        event = msg.get('t')
-        if event:
-            self._dispatch('socket_event_type', event)
+            # most messages fit in a single frame and never touch the buffer
+            if buffer:
+                buffer += inflated
+                inflated = buffer
 
-        op = msg.get('op')
-        data = msg.get('d')
-        seq = msg.get('s')
-        msg_id = msg.get('id')
-        if data is not None and type(data) == dict:
-            data["msg_id"] = msg_id
-
-        if seq is not None:
-            self.sequence = seq
+            # the JSON decoder reads UTF-8 bytes directly, no need to decode first
+            try:
+                if self._enable_debug_events:
+                    self.debug_log_receive(inflated)
+                msg = self._from_json(inflated)
+            finally:
+                buffer.clear()
+        else:
+            if self._enable_debug_events:
+                self.debug_log_receive(msg)
+            msg = self._from_json(msg)
 
+        _log.debug('分片 ID %s：WebSocket 事件：%s', self.shard_id, msg)
+        op = msg['op']
         if self._keep_alive:
             self._keep_alive.tick()
 
         if op != self.DISPATCH:
-            if op == self.RECONNECT:
-                # "reconnect" can only be handled by the Client
-                # so we terminate our connection and raise an
-                # internal exception signalling to reconnect.
-                _log.debug('收到 RECONNECT 操作码。')
-                await self.close()
-                raise ReconnectWebSocket(self.shard_id)
-
-            if op == self.HEARTBEAT_ACK:
-                if self._keep_alive:
-                    self._keep_alive.ack()
-                return
+            seq = msg.get('s')
+            if seq is not None:
+                self.sequence = seq
 
-            if op == self.HEARTBEAT:
-                if self._keep_alive:
-                    beat = self._keep_alive.get_payload()
-                    await self.send_as_json(beat)
-                return
-
-            if op == self.HELLO:
-                interval = data['heartbeat_interval'] / 1000.0
-                self._keep_alive = KeepAliveHandler(ws=self, interval=interval, shard_id=self.shard_id)
-                # send a heartbeat immediately
-                self._keep_alive.start()
+            handler = self._op_handlers.get(op)
+            if handler is None:
+                _log.warning('未知 OP 代码 %s.', op)
                 return
+            await handler(msg.get('d'))
+            return
 
-            if op == self.INVALIDATE_SESSION:
-                if data is True:
-                    await self.close()
-                    raise ReconnectWebSocket(self.shard_id)
+        event = msg['t']
+        self._dispatch('socket_event_type', event)
 
-                self.sequence = None
-                self.session_id = None
-                _log.info('分片 ID %s 会话已失效。', self.shard_id)
-                await self.close(code=1000)
-                raise ReconnectWebSocket(self.shard_id, resume=False)
+        seq = msg['s']
+        if seq is not None:
+            self.sequence = seq
 
-            _log.warning('未知 OP 代码 %s.', op)
-            return
+        data = msg.get('d')
+        if type(data) is dict:
+            data['msg_id'] = msg.get('id')
 
         if event == 'READY':
             self._trace = trace = data.get('_trace', [])
@@ -432,9 +487,8 @@ class QQWebSocket:
             _log.info('分片 ID %s 已在跟踪 %s 下成功恢复会话 %s。',
                       self.shard_id, self.session_id, ', '.join(trace))
 
-        try:
-            func = self._qq_parsers[event]
-        except KeyError:
+        func = self._qq_parsers.get(event)
+        if func is None:
             _log.debug('未知事件 %s.', event)
         else:
             if inspect.iscoroutinefunction(func):
@@ -443,29 +497,32 @@ class QQWebSocket:
                 func(data)
 
         # remove the dispatched listeners
-        removed = []
-        for index, entry in enumerate(self._dispatch_listeners):
-            if entry.event != event:
-                continue
+        # most events have no wait_for listeners, so bail out early
+        entries = self._dispatch_listeners.get(event) if self._dispatch_listeners else None
+        if not entries:
+            return
 
+        kept = []
+        for entry in entries:
             future = entry.future
             if future.cancelled():
-                removed.append(index)
                 continue
 
             try:
                 valid = entry.predicate(data)
             except Exception as exc:
                 future.set_exception(exc)
-                removed.append(index)
             else:
                 if valid:
                     ret = data if entry.result is None else entry.result(data)
                     future.set_result(ret)
-                    removed.append(index)
+                else:
+                    kept.append(entry)
 
-        for index in reversed(removed):
-            del self._dispatch_listeners[index]
+        if not kept:
+            del self._dispatch_listeners[event]
+        elif len(kept) != len(entries):
+            self._dispatch_listeners[event] = kept
 
     @property
     def latency(self):
@@ -526,39 +583,39 @@ class QQWebSocket:
 
     async def send_as_json(self, data):
         try:
-            await self.send(utils._to_json(data))
+            await self.send(self._to_json(data))
         except RuntimeError as exc:
             if not self._can_handle_close():
                 raise ConnectionClosed(self.socket, shard_id=self.shard_id) from exc
 
     async def send_heartbeat(self, data):
         # This bypasses the rate limit handling code since it has a higher priority
+        # the payload only ever carries the sequence, so format it directly
+        seq = data['d']
+        payload = '{"op":%d,"d":%s}' % (data['op'], 'null' if seq is None else int(seq))
         try:
-            await self.socket.send_str(utils._to_json(data))
+            await self.socket.send_str(payload)
         except RuntimeError as exc:
             if not self._can_handle_close():
                 raise ConnectionClosed(self.socket, shard_id=self.shard_id) from exc
 
     async def request_chunks(self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None):
-        payload = {
-            'op': self.REQUEST_MEMBERS,
-            'd': {
-                'guild_id': guild_id,
-                'presences': presences,
-                'limit': limit
-            }
+        d = {
+            'guild_id': guild_id,
+            'presences': presences,
+            'limit': limit
         }
 
         if nonce:
-            payload['d']['nonce'] = nonce
+            d['nonce'] = nonce
 
         if user_ids:
-            payload['d']['user_ids'] = user_ids
+            d['user_ids'] = user_ids
 
         if query is not None:
-            payload['d']['query'] = query
+            d['query'] = query
 
-        await self.send_as_json(payload)
+        await self.send_as_json({'op': self.REQUEST_MEMBERS, 'd': d})
 
     async def close(self, code=4000):
         if self._keep_alive:
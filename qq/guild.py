@@ -21,7 +21,12 @@
 
 from __future__ import annotations
 
+import asyncio
+import bisect
 import datetime
+import logging
+import operator
+from collections import defaultdict
 from typing import (
     Dict,
     List,
@@ -31,6 +36,9 @@ from typing import (
     TYPE_CHECKING,
     Any,
     Sequence,
+    Iterator,
+    Type,
+    TypeVar,
     overload, Literal,
 )
 
@@ -54,7 +62,9 @@ __all__ = (
 
 if TYPE_CHECKING:
     from .state import ConnectionState
+    from .http import HTTPClient
     from .types.guild import Guild as GuildPayload
+    from .types.role import Role as RolePayload
     from .channel import TextChannel, CategoryChannel, AppChannel, LiveChannel, ThreadChannel
     from .state import ConnectionState
 
@@ -62,6 +72,19 @@ if TYPE_CHECKING:
     VocalGuildChannel = Union[VoiceChannel]
     ByCategoryItem = Tuple[Optional[CategoryChannel], List[GuildChannel]]
 
+_log = logging.getLogger(__name__)
+
+GCH = TypeVar('GCH', bound='GuildChannel')
+
+# shared sort keys for the channel views
+_POS_ID_KEY = operator.attrgetter('position', 'id')
+_BUCKET_POS_ID_KEY = operator.attrgetter('_sorting_bucket', 'position', 'id')
+
+
+def _category_item_key(item: ByCategoryItem) -> Tuple[int, int]:
+    category = item[0]
+    return (category.position, category.id) if category else (-1, -1)
+
 
 class Guild(Hashable):
     """代表一个 QQ guild.
@@ -98,6 +121,11 @@ class Guild(Hashable):
 
     description: Optional[:class:`str`]
         guild 的说明。
+    large: :class:`bool`
+        指示频道是否是 ``大型`` 频道。
+        大型频道被定义为拥有超过 ``large_threshold`` 计数的成员，本库的最大值设置为 250。
+    chunked: :class:`bool`
+        指示缓存的成员数是否与 :attr:`member_count` 相等。
     """
 
     __slots__ = (
@@ -111,28 +139,97 @@ class Guild(Hashable):
         'description',
         'joined_at',
         '_channels',
+        '_text_channels',
+        '_app_channels',
+        '_categories',
         '_members',
+        '_members_by_name',
+        '_members_by_nick',
+        '_bots',
+        '_humans',
         '_roles',
+        '_roles_raw',
         '_state',
-        '_large',
+        '_http',
+        'large',
+        'chunked',
         '_permission',
-        'unavailable'
+        '_permission_index',
+        'unavailable',
+        '_text_channels_cache',
+        '_app_channels_cache',
+        '_category_cache',
+        '_roles_sorted_cache',
+        '_shard_id',
+        '_shard_count',
     )
 
     def __init__(self, data: GuildPayload, state: ConnectionState):
         self._channels: Dict[int, GuildChannel] = {}
+        # typed views over _channels, maintained by _add_channel/_remove_channel
+        self._text_channels: Dict[int, TextChannel] = {}
+        self._app_channels: Dict[int, AppChannel] = {}
+        self._categories: Dict[int, CategoryChannel] = {}
         self._members: Dict[int, Member] = {}
+        # name and nick lookups for get_member_named, entries are checked on use
+        self._members_by_name: Dict[str, Member] = {}
+        self._members_by_nick: Dict[str, Member] = {}
+        # _members split by Member.bot, maintained by _add_member/_remove_member
+        self._bots: Dict[int, Member] = {}
+        self._humans: Dict[int, Member] = {}
+        self._roles: Dict[int, Role] = {}
+        # role payloads that haven't been turned into Role objects yet
+        self._roles_raw: Dict[int, RolePayload] = {}
+        self._permission: List[Permission] = []
+        self._permission_index: Dict[Tuple[Optional[str], Optional[str]], Permission] = {}
         self._state: ConnectionState = state
+        self._http: HTTPClient = state.http
+        self._text_channels_cache: Optional[List[TextChannel]] = None
+        self._app_channels_cache: Optional[List[AppChannel]] = None
+        self._category_cache: Optional[List[CategoryChannel]] = None
+        self._roles_sorted_cache: Optional[List[Role]] = None
         self._from_data(data)
 
     def _add_role(self, role: Role, /) -> None:
+        self._roles_raw.pop(role.id, None)
+        old = self._roles.get(role.id)
         self._roles[role.id] = role
+        cache = self._roles_sorted_cache
+        if cache is not None:
+            # keep an already built roles view sorted instead of dropping it
+            if old is not None:
+                self._discard_sorted_role(cache, old)
+            bisect.insort(cache, role)
 
     def _remove_role(self, role_id: int, /) -> Role:
+        data = self._roles_raw.pop(role_id, None)
+        if data is not None:
+            # never built, so it can't be in the sorted view either
+            return Role(guild=self, data=data, state=self._state)
+
         # this raises KeyError if it fails.
         role = self._roles.pop(role_id)
+        cache = self._roles_sorted_cache
+        if cache is not None:
+            self._discard_sorted_role(cache, role)
         return role
 
+    @staticmethod
+    def _discard_sorted_role(cache: List[Role], role: Role, /) -> None:
+        # roles compare by hierarchy rather than identity, so search by identity
+        for index, entry in enumerate(cache):
+            if entry is role:
+                del cache[index]
+                return
+
+    def _inflate_roles(self) -> Dict[int, Role]:
+        raw = self._roles_raw
+        if raw:
+            state = self._state
+            self._roles.update((role_id, Role(guild=self, data=data, state=state)) for role_id, data in raw.items())
+            raw.clear()
+        return self._roles
+
     def _from_data(self, guild: GuildPayload) -> None:
         self.id = int(guild.get('id'))
         self.msg_id = guild.get('msg_id', "")
@@ -145,67 +242,110 @@ class Guild(Hashable):
         self.max_members = guild.get('max_members')
         self.description = guild.get('description')
         self.joined_at = guild.get('joined_at')
-        self._large: Optional[bool] = None if self._member_count is None else self._member_count >= 250
+        self.unavailable: bool = guild.get('unavailable', False)
+        self._update_member_stats()
+        # shard_id only depends on id and the state's shard_count, see shard_id
+        self._shard_count: Optional[int] = None
+        self._shard_id: int = 0
+
+    def _typed_channels(self, channel: GuildChannel, /) -> Optional[Dict[int, Any]]:
+        # the channel classes are leaf types, compare the exact type
+        cls = type(channel)
+        if cls is TextChannel:
+            return self._text_channels
+        if cls is AppChannel:
+            return self._app_channels
+        if cls is CategoryChannel:
+            return self._categories
+        return None
 
     def _add_channel(self, channel: GuildChannel, /) -> None:
-        self._channels[channel.id] = channel
+        channel_id = channel.id
+        old = self._channels.get(channel_id)
+        if old is not None:
+            self._remove_channel(old)
+
+        self._channels[channel_id] = channel
+        typed = self._typed_channels(channel)
+        if typed is not None:
+            typed[channel_id] = channel
+        self._invalidate_channel_cache()
 
     def _remove_channel(self, channel: GuildChannel, /) -> None:
         self._channels.pop(channel.id, None)
+        typed = self._typed_channels(channel)
+        if typed is not None:
+            typed.pop(channel.id, None)
+        self._invalidate_channel_cache()
+
+    def _invalidate_channel_cache(self) -> None:
+        # the sorted channel views are rebuilt lazily on next access
+        self._text_channels_cache = None
+        self._app_channels_cache = None
+        self._category_cache = None
 
     def __str__(self) -> str:
         return self.name or ''
 
     def __repr__(self) -> str:
-        attrs = (
-            ('id', self.id),
-            ('name', self.name),
-            ('member_count', getattr(self, '_member_count', None)),
-        )
-        inner = ' '.join('%s=%r' % t for t in attrs)
-        return f'<Guild {inner}>'
+        return f'<Guild id={self.id!r} name={self.name!r} member_count={self._member_count!r}>'
 
     async def fill_in(self) -> Guild:
-        data = await self._state.http.get_guild(self.id)
+        state = self._state
+        http = self._http
+        data = await http.get_guild(self.id)
         self._from_data(data)
-        self._roles: Dict[int, Role] = {}
-        self._permission: List[Permission] = []
-
-        try:
-            channels = await self._state.http.get_guild_channels(self.id)
-        except HTTPException:
+        guild_id = self.id
+        # refilled below, reuse the existing containers
+        self._roles.clear()
+        self._roles_raw.clear()
+        self._permission.clear()
+        self._permission_index.clear()
+
+        # these requests don't depend on each other, run them concurrently
+        results = await asyncio.gather(
+            http.get_guild_channels(guild_id),
+            http.get_member(guild_id, state.user.id),
+            http.get_permission(guild_id),
+            http.get_roles(guild_id),
+            return_exceptions=True,
+        )
+        for name, result in zip(('channels', 'member', 'permission', 'roles'), results):
+            # a failed request is skipped like before, anything else is a real error
+            if isinstance(result, HTTPException):
+                _log.debug('获取频道 %s 的 %s 失败：%s', guild_id, name, result)
+            elif isinstance(result, BaseException):
+                raise result
+        # anything still an exception here is a skipped HTTPException, checking
+        # BaseException lets type checkers narrow each result to its payload
+        channels, member_data, permissions, roles = results
+
+        if isinstance(channels, BaseException):
             channels = []
 
-        try:
-            result = await self._state.http.get_member(self.id, self._state.user.id)
-
-            member = Member(data=result,
-                            guild=self, state=self._state)
+        if not isinstance(member_data, BaseException):
+            member = Member(data=member_data,
+                            guild=self, state=state)
             self._add_member(member)
-        except HTTPException:
-            pass
 
-        try:
-            permissions = await self._state.http.get_permission(self.id)
+        if not isinstance(permissions, BaseException):
+            permission_list = self._permission
+            permission_index = self._permission_index
             for permission in permissions['apis']:
-                permission = Permission(data=permission, state=self._state, guild=self)
-                self._permission.append(permission)
-        except HTTPException:
-            pass
-
-        try:
-            roles = await self._state.http.get_roles(self.id)
-            if 'roles' in roles:
-                for r in roles['roles']:
-                    role = Role(guild=self, data=r, state=self._state)
-                    self._roles[role.id] = role
-        except HTTPException:
-            pass
+                permission = Permission(data=permission, state=state, guild=self)
+                permission_list.append(permission)
+                permission_index.setdefault((permission.path, permission.method), permission)
+
+        if not isinstance(roles, BaseException):
+            # Role objects are built on first use, see get_role and _inflate_roles
+            self._roles_raw.update((int(r['id']), r) for r in roles.get('roles', ()))
+        self._roles_sorted_cache = None
 
+        add_channel = self._add_channel
         for c in channels:
             factory, ch_type = _guild_channel_factory(c['type'])
             if factory:
-                self._add_channel(factory(guild=self, data=c, state=self._state))  # type: ignore
+                add_channel(factory(guild=self, data=c, state=state))  # type: ignore
         return self
 
     @property
@@ -228,22 +368,28 @@ class Guild(Hashable):
         Optional[:class:`Permission`]
             Role 或如果未找到，则  ``None`` 。
         """
-        for perm in self._permission:
-            if perm.path == path and perm.method == method:
-                return perm
+        return self._permission_index.get((path, method))
 
     @property
     def channels(self) -> List[GuildChannel]:
         """List[:class:`abc.GuildChannel`]: 属于该频道的子频道列表。"""
         return list(self._channels.values())
 
+    def iter_channels(self) -> Iterator[GuildChannel]:
+        """与 :attr:`channels` 相同，但返回一个迭代器而不复制列表。
+
+        .. versionadded:: 1.3.23"""
+        return iter(self._channels.values())
+
     @property
     def shard_id(self) -> int:
         """:class:`int`: 如果适用，返回此频道的分片 ID。"""
         count = self._state.shard_count
-        if count is None:
-            return 0
-        return (self.id >> 22) % count
+        if count != self._shard_count:
+            # recomputed only when the shard count changes
+            self._shard_id = 0 if count is None else (self.id >> 22) % count
+            self._shard_count = count
+        return self._shard_id
 
     @property
     def owner(self) -> Optional[Member]:
@@ -255,17 +401,11 @@ class Guild(Hashable):
         """List[:class:`Member`]: 属于该频道的成员列表。"""
         return list(self._members.values())
 
-    @property
-    def large(self) -> bool:
-        """:class:`bool`: 指示频道是否是 ``大型`` 频道。
-        大型频道被定义为拥有超过 ``large_threshold`` 计数的成员，本库的最大值设置为 250。
-        """
-        if self._large is None:
-            try:
-                return self._member_count >= 250
-            except AttributeError:
-                return len(self._members) >= 250
-        return self._large
+    def iter_members(self) -> Iterator[Member]:
+        """与 :attr:`members` 相同，但返回一个迭代器而不复制列表。
+
+        .. versionadded:: 1.3.23"""
+        return iter(self._members.values())
 
     def get_role(self, role_id: int, /) -> Optional[Role]:
         """返回具有给定 ID 的 Role。
@@ -280,7 +420,12 @@ class Guild(Hashable):
         Optional[:class:`Role`]
             Role 或如果未找到，则  ``None`` 。
         """
-        return self._roles.get(role_id)
+        role = self._roles.get(role_id)
+        if role is None:
+            data = self._roles_raw.pop(role_id, None)
+            if data is not None:
+                role = self._roles[role_id] = Role(guild=self, data=data, state=self._state)
+        return role
 
     # @property
     # def large(self) -> bool:
@@ -308,25 +453,31 @@ class Guild(Hashable):
     def text_channels(self) -> List[TextChannel]:
         """List[:class:`TextChannel`]: 属于该频道的文本频道列表。这是按位置排序的，从上到下按 UI 顺序排列。
         """
-        r = [ch for ch in self._channels.values() if isinstance(ch, TextChannel)]
-        r.sort(key=lambda c: (c.position, c.id))
-        return r
+        r = self._text_channels_cache
+        if r is None:
+            r = sorted(self._text_channels.values(), key=_POS_ID_KEY)
+            self._text_channels_cache = r
+        return r.copy()
 
     @property
     def app_channels(self) -> List[AppChannel]:
         """List[:class:`AppChannel`]: 属于该频道的应用频道列表。这是按位置排序的，从上到下按 UI 顺序排列。
         """
-        r = [ch for ch in self._channels.values() if isinstance(ch, AppChannel)]
-        r.sort(key=lambda c: (c.position, c.id))
-        return r
+        r = self._app_channels_cache
+        if r is None:
+            r = sorted(self._app_channels.values(), key=_POS_ID_KEY)
+            self._app_channels_cache = r
+        return r.copy()
 
     @property
     def categories(self) -> List[CategoryChannel]:
         """List[:class:`CategoryChannel`]: 属于该频道的类别列表。这是按位置排序的，从上到下按 UI 顺序排列。
         """
-        r = [ch for ch in self._channels.values() if isinstance(ch, CategoryChannel)]
-        r.sort(key=lambda c: (c.position, c.id))
-        return r
+        r = self._category_cache
+        if r is None:
+            r = sorted(self._categories.values(), key=_POS_ID_KEY)
+            self._category_cache = r
+        return r.copy()
 
     def by_category(self) -> List[ByCategoryItem]:
         """返回每个 :class:`CategoryChannel` 及其关联的频道。
@@ -338,26 +489,19 @@ class Guild(Hashable):
         List[Tuple[Optional[:class:`CategoryChannel`], List[:class:`abc.GuildChannel`]]]:
             类别及其关联的频道。
         """
-        grouped: Dict[Optional[int], List[GuildChannel]] = {}
+        categories = self._categories
+        grouped: Dict[Optional[int], List[GuildChannel]] = defaultdict(list)
+        # empty categories are still listed
+        grouped.update((category_id, []) for category_id in categories)
         for channel in self._channels.values():
-            if isinstance(channel, CategoryChannel):
-                grouped.setdefault(channel.id, [])
-                continue
-
-            try:
+            if channel.id not in categories:
                 grouped[channel.category_id].append(channel)
-            except KeyError:
-                grouped[channel.category_id] = [channel]
-
-        def key(t: ByCategoryItem) -> Tuple[Tuple[int, int], List[GuildChannel]]:
-            k, v = t
-            return (k.position, k.id) if k else (-1, -1), v
 
         _get = self._channels.get
         as_list: List[ByCategoryItem] = [(_get(k), v) for k, v in grouped.items()]  # type: ignore
-        as_list.sort(key=key)
+        as_list.sort(key=_category_item_key)
         for _, channels in as_list:
-            channels.sort(key=lambda c: (c._sorting_bucket, c.position, c.id))
+            channels.sort(key=_BUCKET_POS_ID_KEY)
         return as_list
 
     def _resolve_channel(self, id: Optional[int], /) -> Optional[Union[GuildChannel,]]:
@@ -400,20 +544,50 @@ class Guild(Hashable):
     def roles(self) -> List[Role]:
         """List[:class:`Role`]: 以层级顺序返回频道身份组的 :class:`list`。此列表的第一个元素将是层次结构中的最低身份组。
         """
-        return sorted(self._roles.values())
+        r = self._roles_sorted_cache
+        if r is None:
+            r = self._roles_sorted_cache = sorted(self._inflate_roles().values())
+        return r.copy()
 
     def _add_member(self, member: Member, /) -> None:
         self._members[member.id] = member
+        (self._bots if member.bot else self._humans)[member.id] = member
+        self._index_member(member)
+        self._update_member_stats()
 
     def _remove_member(self, member: Member, /) -> None:
         self._members.pop(member.id, None)
-
-    @property
-    def chunked(self) -> bool:
-        count = getattr(self, '_member_count', None)
+        self._bots.pop(member.id, None)
+        self._humans.pop(member.id, None)
+        if self._members_by_name.get(member.name) is member:
+            del self._members_by_name[member.name]
+        if member.nick is not None and self._members_by_nick.get(member.nick) is member:
+            del self._members_by_nick[member.nick]
+        self._update_member_stats()
+
+    def _update_member_stats(self) -> None:
+        # large and chunked are plain attributes, refresh them whenever
+        # _members or _member_count changes
+        count = self._member_count
         if count is None:
-            return False
-        return count == len(self._members)
+            self.large = len(self._members) >= 250
+            self.chunked = False
+        else:
+            self.large = count >= 250
+            self.chunked = count == len(self._members)
+
+    def _index_member(self, member: Member, /) -> None:
+        self._members_by_name.setdefault(member.name, member)
+        if member.nick is not None:
+            self._members_by_nick.setdefault(member.nick, member)
+
+    def _lookup_member(self, index: Dict[str, Member], attr: str, key: str, /) -> Optional[Member]:
+        # names live on the shared User and can change without this guild noticing,
+        # so only trust an entry that still matches and is still a member
+        member = index.get(key)
+        if member is None or getattr(member, attr) != key or self._members.get(member.id) is not member:
+            return None
+        return member
 
     def get_member_named(self, name: str, /) -> Optional[Member]:
         """返回找到的第一个与提供的名称匹配的成员。
@@ -430,11 +604,24 @@ class Guild(Hashable):
         Optional[:class:`Member`]
             此频道中具有关联名称的成员。如果未找到，则返回  ``None`` 。
         """
-        members = self.members
-        result = utils.get(members, name=name[:-5])
+        # only strip the 5 character suffix when something is left of the name
+        stripped = name[:-5] if len(name) > 5 else None
+        lookup = self._lookup_member
+        result = (
+            (stripped is not None and lookup(self._members_by_name, 'name', stripped))
+            or lookup(self._members_by_nick, 'nick', name)
+            or lookup(self._members_by_name, 'name', name)
+        )
         if result is not None:
             return result
 
+        # the indexes may be stale after a rename, fall back to a full scan
+        members = self._members.values()
+        if stripped is not None:
+            result = utils.get(members, name=stripped)
+            if result is not None:
+                return result
+
         def pred(m: Member) -> bool:
             return m.nick == name or m.name == name
 
@@ -510,14 +697,9 @@ class Guild(Hashable):
         if private_type == 2 and private_members is not MISSING:
             options['private_user_ids'] = [str(n.id) for n in private_members]
 
-        data = await self._create_channel(
-            name, channel_type=ChannelType.text, category=category, reason=reason, **options
+        return await self._create_and_cache_channel(
+            TextChannel, name, ChannelType.text, category=category, reason=reason, **options
         )
-        channel = TextChannel(state=self._state, guild=self, data=data)
-
-        # temporarily add to the cache
-        self._channels[channel.id] = channel
-        return channel
 
     def _create_channel(
             self,
@@ -527,10 +709,26 @@ class Guild(Hashable):
             **options: Any,
     ):
         parent_id = category.id if category else None
-        return self._state.http.create_channel(
+        return self._http.create_channel(
             self.id, channel_type.value, name=name, parent_id=parent_id, **options
         )
 
+    async def _create_and_cache_channel(
+            self,
+            cls: Type[GCH],
+            name: str,
+            channel_type: ChannelType,
+            category: Optional[CategoryChannel] = None,
+            **options: Any,
+    ) -> GCH:
+        # shared tail of the create_*_channel methods
+        data = await self._create_channel(name, channel_type=channel_type, category=category, **options)
+        channel = cls(state=self._state, guild=self, data=data)  # type: ignore
+
+        # temporarily add to the cache
+        self._add_channel(channel)
+        return channel
+
     async def create_live_channel(
             self,
             name: str,
@@ -570,14 +768,9 @@ class Guild(Hashable):
         if position is not MISSING:
             options['position'] = position
 
-        data = await self._create_channel(
-            name, channel_type=ChannelType.live, category=category, reason=reason, **options
+        return await self._create_and_cache_channel(
+            LiveChannel, name, ChannelType.live, category=category, reason=reason, **options
         )
-        channel = LiveChannel(state=self._state, guild=self, data=data)
-
-        # temporarily add to the cache
-        self._channels[channel.id] = channel
-        return channel
 
     async def create_app_channel(
             self,
@@ -618,14 +811,9 @@ class Guild(Hashable):
         if position is not MISSING:
             options['position'] = position
 
-        data = await self._create_channel(
-            name, channel_type=ChannelType.live, category=category, reason=reason, **options
+        return await self._create_and_cache_channel(
+            AppChannel, name, ChannelType.app, category=category, reason=reason, **options
         )
-        channel = AppChannel(state=self._state, guild=self, data=data)
-
-        # temporarily add to the cache
-        self._channels[channel.id] = channel
-        return channel
 
     async def create_thread_channel(
             self,
@@ -666,14 +854,9 @@ class Guild(Hashable):
         if position is not MISSING:
             options['position'] = position
 
-        data = await self._create_channel(
-            name, channel_type=ChannelType.live, category=category, reason=reason, **options
+        return await self._create_and_cache_channel(
+            ThreadChannel, name, ChannelType.thread, category=category, reason=reason, **options
         )
-        channel = ThreadChannel(state=self._state, guild=self, data=data)
-
-        # temporarily add to the cache
-        self._channels[channel.id] = channel
-        return channel
 
     async def create_category(
             self,
@@ -704,14 +887,9 @@ class Guild(Hashable):
         if position is not MISSING:
             options['position'] = position
 
-        data = await self._create_channel(
-            name, channel_type=ChannelType.category, reason=reason, **options
+        return await self._create_and_cache_channel(
+            CategoryChannel, name, ChannelType.category, reason=reason, **options
         )
-        channel = CategoryChannel(state=self._state, guild=self, data=data)
-
-        # temporarily add to the cache
-        self._channels[channel.id] = channel
-        return channel
 
     create_category_channel = create_category
 
@@ -734,14 +912,15 @@ class Guild(Hashable):
         Sequence[:class:`abc.GuildChannel`]
             频道内的所有频道。
         """
-        data = await self._state.http.get_guild_channels(self.id)
+        state = self._state
+        data = await self._http.get_guild_channels(self.id)
 
         def convert(d):
             factory, ch_type = _guild_channel_factory(d['type'])
             if factory is None:
                 raise InvalidData('Unknown channel type {type} for channel ID {id}.'.format_map(d))
 
-            channel = factory(guild=self, state=self._state, data=d)
+            channel = factory(guild=self, state=state, data=d)
             return channel
 
         return [convert(d) for d in data]
@@ -814,7 +993,7 @@ class Guild(Hashable):
         :class:`Member`
             来自会员 ID 的会员。
         """
-        data = await self._state.http.get_member(self.id, member_id)
+        data = await self._http.get_member(self.id, member_id)
         return Member(data=data, state=self._state, guild=self)
 
     async def fetch_channel(self, channel_id: int, /) -> GuildChannel:
@@ -841,7 +1020,7 @@ class Guild(Hashable):
         :class:`.abc.GuildChannel`
             来自 ID 的频道。
         """
-        data = await self._state.http.get_channel(channel_id)
+        data = await self._http.get_channel(channel_id)
 
         factory, ch_type = _channel_factory(data['type'])
         if factory is None:
@@ -871,8 +1050,9 @@ class Guild(Hashable):
         List[:class:`Role`]
             频道中的所有身份组。
         """
-        data = await self._state.http.get_roles(self.id)
-        return [Role(guild=self, state=self._state, data=d) for d in data["roles"]]
+        state = self._state
+        data = await self._http.get_roles(self.id)
+        return [Role(guild=self, state=state, data=d) for d in data["roles"]]
 
     @overload
     async def create_role(
@@ -955,9 +1135,10 @@ class Guild(Hashable):
         if name is not MISSING:
             fields['name'] = name
 
-        data = await self._state.http.create_role(self.id, reason=reason, **fields)
+        data = await self._http.create_role(self.id, reason=reason, **fields)
         role = Role(guild=self, data=data['role'], state=self._state)
-
+        # there is no gateway event for roles, keep the cache in sync here
+        self._add_role(role)
         return role
 
     async def kick(self, user: Member, *, reason: Optional[str] = None) -> None:
@@ -978,7 +1159,7 @@ class Guild(Hashable):
         HTTPException
             踢出失败。
         """
-        await self._state.http.kick(user.id, self.id, add_blacklist=False, reason=reason)
+        await self._http.kick(user.id, self.id, add_blacklist=False, reason=reason)
 
     async def ban(
             self,
@@ -1007,7 +1188,7 @@ class Guild(Hashable):
         HTTPException
             封禁失败。
         """
-        await self._state.http.kick(user.id, self.id, add_blacklist=True, reason=reason)
+        await self._http.kick(user.id, self.id, add_blacklist=True, reason=reason)
 
     async def unmute_member(
             self,
@@ -1071,6 +1252,10 @@ class Guild(Hashable):
         """|coro|
         频道指定成员禁言。
 
+        .. note::
+
+            短时间内对同一频道、以相同时长和原因发起的多个禁言会合并为一次 :meth:`mute_members` 请求。
+
         Parameters
         -----------
         user: :class:`qq.Member`
@@ -1087,7 +1272,7 @@ class Guild(Hashable):
         HTTPException
             禁言失败。
         """
-        await self._state.http.mute_member(user.id, self.id, duration, reason=reason)
+        await self._state.queue_mute(self.id, user.id, duration, reason=reason)
 
     async def mute_members(
             self,
@@ -1116,9 +1301,9 @@ class Guild(Hashable):
             禁言失败。
         """
         if len(user) == 1:
-            await self._state.http.mute_member(user[0].id, self.id, duration, reason=reason)
+            await self._http.mute_member(user[0].id, self.id, duration, reason=reason)
             return
-        await self._state.http.mute_members([u.id for u in user], self.id, duration, reason=reason)
+        await self._http.mute_members([u.id for u in user], self.id, duration, reason=reason)
 
     async def mute_guild(
             self,
@@ -1144,14 +1329,14 @@ class Guild(Hashable):
         HTTPException
             禁言失败。
         """
-        await self._state.http.mute_guild(self.id, duration, reason=reason)
+        await self._http.mute_guild(self.id, duration, reason=reason)
 
     @property
     def bots(self) -> List[Member]:
         """List[:class:`Member`]: 属于该频道的机器人列表。
 
         .. versionadded:: 1.1.0"""
-        return [m for m in self._members.values() if m.bot]
+        return list(self._bots.values())
 
     @property
     def humans(self) -> List[Member]:
@@ -1162,7 +1347,19 @@ class Guild(Hashable):
             由于 QQ 的限制，为了使该属性保持最新和准确，它需要 ``Intents.members``。
 
         .. versionadded:: 1.1.0"""
-        return [m for m in self._members.values() if not m.bot]
+        return list(self._humans.values())
+
+    def iter_bots(self) -> Iterator[Member]:
+        """与 :attr:`bots` 相同，但返回一个迭代器而不复制列表。
+
+        .. versionadded:: 1.3.23"""
+        return iter(self._bots.values())
+
+    def iter_humans(self) -> Iterator[Member]:
+        """与 :attr:`humans` 相同，但返回一个迭代器而不复制列表。
+
+        .. versionadded:: 1.3.23"""
+        return iter(self._humans.values())
 
     async def unpin(self, reason: Optional[str] = None):
         """
@@ -1182,4 +1379,4 @@ class Guild(Hashable):
         HTTPException
             删除公告失败。
         """
-        await self._state.http.global_unpin_message(self.id, 'all', reason=reason)
+        await self._http.global_unpin_message(self.id, 'all', reason=reason)
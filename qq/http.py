@@ -23,9 +23,12 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import functools
 import logging
+import math
+import random
+import string
 import sys
-import weakref
 from types import TracebackType
 from typing import (
     ClassVar, Any, Optional, Dict, Union, TypeVar, Type,
@@ -36,7 +39,6 @@ from urllib.parse import quote as _uriquote
 import aiohttp
 
 from . import __version__, utils
-from .backoff import ExponentialBackoff
 from .embeds import Ark, Embed, Markdown
 from .error import HTTPException, Forbidden, NotFound, QQServerError, LoginFailure, GatewayNotFound
 from .gateway import QQClientWebSocketResponse
@@ -63,22 +65,100 @@ if TYPE_CHECKING:
 
 T = TypeVar('T')
 BE = TypeVar('BE', bound=BaseException)
-MU = TypeVar('MU', bound='MaybeUnlock')
 Response = Coroutine[Any, Any, T]
 _log = logging.getLogger(__name__)
 
 __all__ = ('Route', 'HTTPClient')
 
+# full jitter exponential backoff for retried requests, in seconds
+_RETRY_BASE_DELAY = 0.5
+_RETRY_MAX_DELAY = 30.0
+
+# POST is left out, e.g. a message could be sent twice after a 5xx the server already acted on
+_RETRY_5XX_METHODS = frozenset(('GET', 'PUT', 'DELETE', 'PATCH'))
+
+
+def _retry_delay(tries: int) -> float:
+    return random.uniform(0, min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** tries))
+
+
+def _parse_delay(value: Optional[str]) -> float:
+    # rate limit headers in seconds, anything unusable (HTTP-dates, nan, negative) becomes 0
+    if not value:
+        return 0.0
+    try:
+        delay = float(value)
+    except ValueError:
+        return 0.0
+    return delay if math.isfinite(delay) and delay > 0 else 0.0
+
+
+def _ms_ts(value: Union[datetime.datetime, float]) -> str:
+    # the API takes timestamps as strings of milliseconds
+    if isinstance(value, datetime.datetime):
+        value = value.timestamp()
+    return str(int(value * 1000))
+
+
+def _mute_fields(duration: Union[datetime.datetime, int]) -> Dict[str, str]:
+    # a datetime is when the mute ends, anything else is its length in seconds
+    if isinstance(duration, datetime.datetime):
+        return {'mute_end_timestamp': _ms_ts(duration)}
+    return {'mute_seconds': str(duration)}
+
+
+# characters _uriquote(reason, safe='/ ') leaves untouched
+_REASON_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '_.-~/ ')
+
+
+def _quote_reason(reason: str) -> str:
+    if _REASON_SAFE_CHARS.issuperset(reason):
+        return reason
+    return _uriquote(reason, safe='/ ')
+
+
+# fields the edit/create endpoints accept
+_ROLE_EDIT_KEYS = frozenset(('name', 'color', 'hoist'))
+_CHANNEL_CREATE_KEYS = frozenset(
+    ('name', 'parent_id', 'position', 'private_type', 'speak_permission', 'application_id')
+)
+_CHANNEL_EDIT_KEYS = frozenset(('name', 'parent_id', 'position', 'type', 'private_type', 'speak_permission'))
+_CHANNEL_POSITION_KEYS = frozenset(('name', 'parent_id', 'position', 'type'))
+
+
+_formatter = string.Formatter()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_path(path: str) -> Tuple[str, Tuple[str, ...]]:
+    # turn '/channels/{channel_id}' into ('/channels/%s', ('channel_id',)) once per path
+    parts = []
+    fields = []
+    for literal, field, _, _ in _formatter.parse(path):
+        parts.append(literal.replace('%', '%%'))
+        if field is not None:
+            parts.append('%s')
+            fields.append(field)
+    return ''.join(parts), tuple(fields)
+
 
 class Route:
     BASE: ClassVar[str] = 'https://api.sgroup.qq.com'
 
+    __slots__ = ('path', 'method', 'url', 'channel_id', 'guild_id', 'token')
+
     def __init__(self, method: str, path: str, **parameters: Any) -> None:
         self.path: str = path
         self.method: str = method
-        url = self.BASE + self.path
         if parameters:
-            url = url.format_map({k: _uriquote(v) if isinstance(v, str) else v for k, v in parameters.items()})
+            template, fields = _compile_path(path)
+            values = []
+            for field in fields:
+                value = parameters[field]
+                values.append(_uriquote(value) if isinstance(value, str) else value)
+            url = self.BASE + template % tuple(values)
+        else:
+            url = self.BASE + path
         self.url: str = url
 
         # major parameters:
@@ -87,21 +167,26 @@ class Route:
         self.token: Optional[str] = parameters.get('token')
 
     @property
-    def bucket(self) -> str:
-        # the bucket is just method + path w/ major parameters
-        return f'{self.channel_id}:{self.guild_id}:{self.path}'
+    def bucket(self) -> Tuple[str, Any, Any, str]:
+        # the bucket is just method + path w/ major parameters, only used as a dict key
+        return self.method, self.channel_id, self.guild_id, self.path
 
 
 async def json_or_text(response: aiohttp.ClientResponse) -> Union[Dict[str, Any], str]:
-    text = await response.text(encoding='utf-8')
-    try:
-        if response.headers['content-type'] == 'application/json':
-            return utils._from_json(text)
-    except Exception:
-        # Thanks Cloudflare
-        pass
+    if response.status == 204 or response.content_length == 0:
+        return ''
+
+    # content_type has the parameters (e.g. charset) stripped
+    if response.content_type == 'application/json':
+        body = await response.read()
+        try:
+            # the json decoders take bytes, no need to decode to str first
+            return utils._from_json(body)
+        except ValueError:
+            # Thanks Cloudflare
+            return body.decode('utf-8')
 
-    return text
+    return await response.text(encoding='utf-8')
 
 
 class MultipartParameters(NamedTuple):
@@ -180,27 +265,6 @@ def handle_message_parameters(
     return MultipartParameters(direct=direct, payload=payload, multipart=multipart, file=file)
 
 
-class MaybeUnlock:
-    def __init__(self, lock: asyncio.Lock) -> None:
-        self.lock: asyncio.Lock = lock
-        self._unlock: bool = True
-
-    def __enter__(self: MU) -> MU:
-        return self
-
-    def defer(self) -> None:
-        self._unlock = False
-
-    def __exit__(
-            self,
-            exc_type: Optional[Type[BE]],
-            exc: Optional[BE],
-            traceback: Optional[TracebackType],
-    ) -> None:
-        if self._unlock:
-            self.lock.release()
-
-
 class HTTPClient:
     """Represents an HTTP client sending HTTP requests to the QQ API."""
 
@@ -214,12 +278,16 @@ class HTTPClient:
             unsync_clock: bool = True,
     ) -> None:
         self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop() if loop is None else loop
-        self.connector = connector
+        self.connector: Optional[aiohttp.BaseConnector] = connector
+        # when no connector is given we build our own in _create_session and keep it across recreate()
+        self._owns_connector: bool = connector is None
         self.__session: aiohttp.ClientSession = MISSING  # filled in static_login
-        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # buckets that got rate limited, requests to them wait until the event is set
+        self._blocked_buckets: Dict[Tuple[str, Any, Any, str], asyncio.Event] = {}
         self._global_over: asyncio.Event = asyncio.Event()
         self._global_over.set()
-        self.token: Optional[str] = None
+        # caps background requests started through _submit
+        self._background: asyncio.Semaphore = asyncio.Semaphore(16)
         self.bot_token: bool = False
         self.proxy: Optional[str] = proxy
         self.proxy_auth: Optional[aiohttp.BasicAuth] = proxy_auth
@@ -227,6 +295,21 @@ class HTTPClient:
 
         user_agent = "QQBot (https://github.com/foxwhite25/qq.py {0}) Python/{1[0]}.{1[1]} aiohttp/{2}"
         self.user_agent: str = user_agent.format(__version__, sys.version_info, aiohttp.__version__)
+        self.token = None
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._token
+
+    @token.setter
+    def token(self, value: Optional[str]) -> None:
+        self._token: Optional[str] = value
+        # shared by every request() instead of rebuilding the headers every call
+        headers = {'User-Agent': self.user_agent}
+        if value is not None:
+            headers['Authorization'] = 'Bot ' + value
+        self._base_headers: Dict[str, str] = headers
+        self._base_headers_json: Dict[str, str] = {**headers, 'Content-Type': 'application/json'}
 
     async def request(
             self,
@@ -240,26 +323,13 @@ class HTTPClient:
         method = route.method
         url = route.url
 
-        lock = self._locks.get(bucket)
-        if lock is None:
-            lock = asyncio.Lock()
-            if bucket is not None:
-                self._locks[bucket] = lock
-
-        headers: Dict[str, str] = {
-            'User-Agent': self.user_agent,
-        }
-
-        # Add token to header
-        if self.token is not None:
-            headers['Authorization'] = 'Bot ' + self.token
-
         # Checking if it's a JSON request
         if 'json' in kwargs:
-            headers['Content-Type'] = 'application/json'
-            kwargs['data'] = utils._to_json(kwargs.pop('json'))
-
-        kwargs['headers'] = headers
+            headers = self._base_headers_json
+            # aiohttp sends bytes as is, skip the str round trip
+            kwargs['data'] = utils._to_json_bytes(kwargs.pop('json'))
+        else:
+            headers = self._base_headers
 
         # Proxy support
         if self.proxy is not None:
@@ -277,80 +347,127 @@ class HTTPClient:
             pass
         else:
             if reason:
-                headers['X-Audit-Log-Reason'] = _uriquote(reason, safe='/ ')
+                # the base headers are shared, only copy them when something is added
+                headers = {**headers, 'X-Audit-Log-Reason': _quote_reason(reason)}
+
+        kwargs['headers'] = headers
 
         response: Optional[aiohttp.ClientResponse] = None
         data: Optional[Union[Dict[str, Any], str]] = None
-        await lock.acquire()
-        backoff = ExponentialBackoff()
-
-        with MaybeUnlock(lock) as maybe_lock:
-            for tries in range(5):
-                if file:
-                    file.reset(seek=tries)
-
-                if form:
-                    form_data = aiohttp.FormData()
-                    for key, value in form.items():
-                        form_data.add_field(key, value)
-                    kwargs['data'] = form_data
-                try:
-                    async with self.__session.request(method, url, **kwargs) as response:
+
+        for tries in range(5):
+            blocked = self._blocked_buckets.get(bucket)
+            if blocked is not None:
+                await blocked.wait()
+
+            if file:
+                file.reset(seek=tries)
+
+            if form:
+                form_data = aiohttp.FormData()
+                for key, value in form.items():
+                    form_data.add_field(key, value)
+                kwargs['data'] = form_data
+            try:
+                async with self.__session.request(method, url, **kwargs) as response:
+                    debug = _log.isEnabledFor(logging.DEBUG)
+                    if debug:
                         _log.debug(
                             '%s %s 与 %s 已返回 %s Trace ID: %s', method, url, kwargs.get('data'),
-                            response.status,
-                            response.headers['X-Tps-trace-ID'] if 'X-Tps-trace-ID' in response.headers else "Missing"
+                            response.status, response.headers.get('X-Tps-trace-ID', 'Missing')
                         )
 
-                        # even errors have text involved in them so this is safe to call
-                        data = await json_or_text(response)
-
-                        # the request was successful so just return the text/json
-                        if 300 > response.status >= 200:
-                            if response.status != 204:
-                                _log.debug('%s %s 已收到 %s', method, url, data)
-                            return data
-
-                        # we've received a 500, 502, or 504, unconditional retry
-                        # if response.status in (500, 502, 504):
-                        #     await asyncio.sleep(1 + tries * 2)
-                        #     continue
-
-                        # the usual error cases
-                        if response.status in [404, 403, 401]:
-                            raise Forbidden(response, data, route=route)
-                        elif response.status == 404:
-                            raise NotFound(response, data, route=route)
-                        elif response.status >= 500:
-                            raise QQServerError(response, data, route=route)
-                        else:
-                            raise HTTPException(response, data, route=route)
-
-                    # This is handling exceptions from the request
-                except OSError as e:
-                    # Connection reset by peer
-                    if tries < 4 and e.errno in (54, 10054):
-                        await asyncio.sleep(backoff.delay())
-                        continue
-                    raise
-                except HTTPException as e:
-                    if tries < 6 and e.code in (620006, 100017):
-                        await asyncio.sleep(backoff.delay())
+                    # even errors have text involved in them so this is safe to call
+                    data = await json_or_text(response)
+
+                    # the request was successful so just return the text/json
+                    if 300 > response.status >= 200:
+                        if debug and response.status != 204:
+                            _log.debug('%s %s 已收到 %s', method, url, data)
+
+                        # the bucket is used up, hold back the next ones locally instead of eating a 429
+                        if response.headers.get('X-RateLimit-Remaining') == '0':
+                            reset_after = _parse_delay(response.headers.get('X-RateLimit-Reset-After'))
+                            if reset_after > 0:
+                                self._block_bucket(bucket, reset_after)
+                        return data
+
+                    # we are being rate limited, hold back this bucket and retry
+                    if response.status == 429 and tries < 4:
+                        delay = _parse_delay(response.headers.get('Retry-After')) or _retry_delay(tries)
+                        _log.warning('%s %s 触发速率限制，将在 %.2f 秒后重试。', method, url, delay)
+                        self._block_bucket(bucket, delay)
                         continue
-                    raise e
 
-                if response is not None:
-                    # We've run out of retries, raise.
-                    if response.status >= 500:
-                        raise QQServerError(response, data)
-
-                    raise HTTPException(response, data)
+                    # we've received a 500, 502, or 504, retry unless the request may already have gone through
+                    if response.status in (500, 502, 504) and tries < 4 and method.upper() in _RETRY_5XX_METHODS:
+                        await asyncio.sleep(_retry_delay(tries))
+                        continue
 
-                raise RuntimeError('HTTP 处理中无法访问的代码')
+                    # the usual error cases
+                    if response.status in [404, 403, 401]:
+                        raise Forbidden(response, data, route=route)
+                    elif response.status == 404:
+                        raise NotFound(response, data, route=route)
+                    elif response.status >= 500:
+                        raise QQServerError(response, data, route=route)
+                    else:
+                        raise HTTPException(response, data, route=route)
+
+                # This is handling exceptions from the request
+            except OSError as e:
+                # Connection reset by peer
+                if tries < 4 and e.errno in (54, 10054):
+                    await asyncio.sleep(_retry_delay(tries))
+                    continue
+                raise
+            except HTTPException as e:
+                if tries < 4 and e.code in (620006, 100017):
+                    await asyncio.sleep(_retry_delay(tries))
+                    continue
+                raise e
+
+            if response is not None:
+                # We've run out of retries, raise.
+                if response.status >= 500:
+                    raise QQServerError(response, data)
+
+                raise HTTPException(response, data)
+
+            raise RuntimeError('HTTP 处理中无法访问的代码')
+
+    async def _submit(self, coro: Response[T]) -> T:
+        # for fire-and-forget requests, e.g. delayed deletes, so a burst of them
+        # doesn't open an unbounded number of requests at once
+        async with self._background:
+            return await coro
+
+    def _block_bucket(self, bucket: Tuple[str, Any, Any, str], delay: float) -> None:
+        if bucket in self._blocked_buckets:
+            return
+
+        event = self._blocked_buckets[bucket] = asyncio.Event()
+        asyncio.get_running_loop().call_later(delay, self._unblock_bucket, bucket, event)
+
+    def _unblock_bucket(self, bucket: Tuple[str, Any, Any, str], event: asyncio.Event) -> None:
+        if self._blocked_buckets.get(bucket) is event:
+            del self._blocked_buckets[bucket]
+        event.set()
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        if not self._owns_connector:
+            return aiohttp.ClientSession(connector=self.connector, ws_response_class=QQClientWebSocketResponse)
+
+        if self.connector is None or self.connector.closed:
+            # every request goes to the same API host, keep warm connections and DNS around for longer
+            self.connector = aiohttp.TCPConnector(limit=100, limit_per_host=64, keepalive_timeout=75, ttl_dns_cache=300)
+        return aiohttp.ClientSession(
+            connector=self.connector, connector_owner=False, ws_response_class=QQClientWebSocketResponse
+        )
 
     async def static_login(self, token: str) -> user.User:
         # Necessary to get aiohttp to stop complaining about session creation
-        self.__session = aiohttp.ClientSession(connector=self.connector, ws_response_class=QQClientWebSocketResponse)
+        self.__session = self._create_session()
         old_token = self.token
         self.token = token
 
@@ -393,15 +510,14 @@ class HTTPClient:
 
     # 身份组管理
 
-    def get_roles(self, guild_id: int) -> Response[List[RolePayload]]:
+    def get_roles(self, guild_id: int) -> Response[Dict[str, Any]]:
         return self.request(Route('GET', '/guilds/{guild_id}/roles', guild_id=guild_id))
 
     def edit_role(
             self, guild_id: int, role_id: int, *, reason: Optional[str] = None, **fields: Any
     ) -> Response[RolePayload]:
         r = Route('PATCH', '/guilds/{guild_id}/roles/{role_id}', guild_id=guild_id, role_id=role_id)
-        valid_keys = ('name', 'color', 'hoist')
-        payload = {"info": {k: v for k, v in fields.items() if k in valid_keys}}
+        payload = {"info": {k: v for k, v in fields.items() if k in _ROLE_EDIT_KEYS}}
         return self.request(r, json=payload, reason=reason)
 
     def delete_role(self, guild_id: int, role_id: int, *, reason: Optional[str] = None) -> Response[None]:
@@ -456,15 +572,7 @@ class HTTPClient:
             'type': channel_type,
         }
 
-        valid_keys = (
-            'name',
-            'parent_id',
-            'position',
-            'private_type',
-            'speak_permission',
-            'application_id',
-        )
-        payload.update({k: str(v) for k, v in options.items() if k in valid_keys and v is not None})
+        payload.update({k: str(v) for k, v in options.items() if k in _CHANNEL_CREATE_KEYS and v is not None})
 
         if 'private_user_ids' in options:
             payload['private_user_ids'] = [str(x) for x in options['private_user_ids']]
@@ -483,15 +591,7 @@ class HTTPClient:
             **options: Any,
     ) -> Response[channel.Channel]:
         r = Route('PATCH', '/channels/{channel_id}', channel_id=channel_id)
-        valid_keys = (
-            'name',
-            'parent_id',
-            'position',
-            'type',
-            'private_type',
-            'speak_permission',
-        )
-        payload = {k: v for k, v in options.items() if k in valid_keys}
+        payload = {k: v for k, v in options.items() if k in _CHANNEL_EDIT_KEYS}
         return self.request(r, reason=reason, json=payload)
 
     def bulk_channel_update(
@@ -500,19 +600,14 @@ class HTTPClient:
             datas: List[guild.ChannelPositionUpdate],
             *,
             reason: Optional[str] = None,
-    ) -> List[Response[None]]:
+    ) -> asyncio.Future[List[None]]:
         rsp = []
         for data in datas:
-            valid_keys = (
-                'name',
-                'parent_id',
-                'position',
-                'type',
-            )
-            payload = {k: v for k, v in data.items() if k in valid_keys}
+            payload = {k: v for k, v in data.items() if k in _CHANNEL_POSITION_KEYS}
             r = Route('PATCH', '/channels/{channel_id}', channel_id=data.get('id'))
             rsp.append(self.request(r, reason=reason, json=payload))
-        return rsp
+        # there is no bulk endpoint, send the updates concurrently
+        return asyncio.gather(*rsp)
 
     def delete_channel(
             self,
@@ -554,13 +649,13 @@ class HTTPClient:
 
     def recreate(self) -> None:
         if self.__session.closed:
-            self.__session = aiohttp.ClientSession(
-                connector=self.connector, ws_response_class=QQClientWebSocketResponse
-            )
+            self.__session = self._create_session()
 
     async def close(self) -> None:
         if self.__session:
             await self.__session.close()
+        if self._owns_connector and self.connector is not None:
+            await self.connector.close()
 
     async def ws_connect(self, url: str, *, compress: int = 0) -> Any:
         kwargs = {
@@ -644,10 +739,8 @@ class HTTPClient:
         payload: Dict[str, Any] = {
             "schedule": {
                 "name": name,
-                "start_timestamp": str(int(start_timestamp * 1000)) if isinstance(start_timestamp, float)
-                else str(int(start_timestamp.timestamp() * 1000)),
-                "end_timestamp": str(int(end_timestamp * 1000)) if isinstance(end_timestamp, float)
-                else str(int(end_timestamp.timestamp() * 1000)),
+                "start_timestamp": _ms_ts(start_timestamp),
+                "end_timestamp": _ms_ts(end_timestamp),
                 "jump_channel_id": str(jump_channel_id),
                 "remind_type": remind_type
             }
@@ -671,11 +764,7 @@ class HTTPClient:
     def mute_member(
             self, user_id: int, guild_id: int, duration: Union[datetime.datetime, int], reason: Optional[str] = None
     ) -> Response[None]:
-        payload: Dict[str, Any] = {}
-        if isinstance(duration, datetime.datetime):
-            payload['mute_end_timestamp'] = str(int(duration.timestamp() * 1000))
-        else:
-            payload['mute_seconds'] = str(duration)
+        payload: Dict[str, Any] = _mute_fields(duration)
 
         r = Route('PATCH', '/guilds/{guild_id}/members/{user_id}/mute', guild_id=guild_id, user_id=user_id)
         return self.request(r, json=payload, reason=reason)
@@ -686,12 +775,7 @@ class HTTPClient:
             duration: Union[datetime.datetime, int],
             reason: Optional[str] = None
     ) -> Response[None]:
-        payload: Dict[str, Any] = {'user_ids': user_id}
-
-        if isinstance(duration, datetime.datetime):
-            payload['mute_end_timestamp'] = str(int(duration.timestamp() * 1000))
-        else:
-            payload['mute_seconds'] = str(duration)
+        payload: Dict[str, Any] = {'user_ids': user_id, **_mute_fields(duration)}
 
         r = Route('PATCH', '/guilds/{guild_id}/mute', guild_id=guild_id)
         return self.request(r, json=payload, reason=reason)
@@ -699,11 +783,7 @@ class HTTPClient:
     def mute_guild(
             self, guild_id: int, duration: Union[datetime.datetime, int], reason: Optional[str] = None
     ) -> Response[None]:
-        payload: Dict[str, Any] = {}
-        if isinstance(duration, datetime.datetime):
-            payload['mute_end_timestamp'] = str(int(duration.timestamp() * 1000))
-        else:
-            payload['mute_seconds'] = str(duration)
+        payload: Dict[str, Any] = _mute_fields(duration)
 
         r = Route('PATCH', '/guilds/{guild_id}/mute', guild_id=guild_id)
         return self.request(r, json=payload, reason=reason)
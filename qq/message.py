@@ -869,8 +869,9 @@ class Message(Hashable):
 
             async def delete(delay: float):
                 await asyncio.sleep(delay)
+                http = self._state.http
                 try:
-                    await self._state.http.delete_message(self.channel.id, self.id, hidetip=hidetip)
+                    await http._submit(http.delete_message(self.channel.id, self.id, hidetip=hidetip))
                 except HTTPException:
                     pass
 
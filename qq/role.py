@@ -158,12 +158,11 @@ class Role(Hashable):
     @property
     def members(self) -> List[Member]:
         """List[:class:`Member`]: 返回具有此身份组的所有成员。"""
-        all_members = self.guild.members
         if self.is_default():
-            return all_members
+            return self.guild.members
 
         role_id = self.id
-        return [member for member in all_members if member._roles.has(role_id)]
+        return [member for member in self.guild.iter_members() if member._roles.has(role_id)]
 
     async def edit(
             self,
@@ -217,3 +216,8 @@ class Role(Hashable):
         """
 
         await self._state.http.delete_role(self.guild.id, self.id, reason=reason)
+        # there is no gateway event for roles, keep the cache in sync here
+        try:
+            self.guild._remove_role(self.id)
+        except KeyError:
+            pass
@@ -34,6 +34,7 @@ from typing import Callable, TYPE_CHECKING, Dict, Any, Optional, List, Union, De
 from . import utils
 from .audio import AudioAction
 from .channel import PartialMessageable, TextChannel, _channel_factory, DMChannel
+from .error import HTTPException, Forbidden
 from .flags import Intents
 from .guild import Guild
 from .interaction import Interaction
@@ -113,6 +114,21 @@ class ChunkRequest:
 
 _log = logging.getLogger(__name__)
 
+# guilds filled in at the same time during READY
+_GUILD_FILL_IN_CONCURRENCY = 16
+# how long queue_mute waits for more mutes of the same batch
+_MUTE_BATCH_DELAY = 0.005
+
+
+def _is_member_mute_error(error: Exception) -> bool:
+    # a client error about one of the members, rather than the request as a whole
+    return (
+        isinstance(error, HTTPException)
+        and not isinstance(error, Forbidden)
+        and 400 <= error.status < 500
+        and error.status != 429
+    )
+
 
 async def logging_coroutine(coroutine: Coroutine[Any, Any, T], *, info: str) -> Optional[T]:
     try:
@@ -162,6 +178,8 @@ class ConnectionState:
 
         self.allowed_mentions: Optional[AllowedMentions] = allowed_mentions
         self._chunk_requests: Dict[Union[int, str], ChunkRequest] = {}
+        # (guild_id, duration, reason) -> (user ids, flush task)
+        self._mute_batches: Dict[Tuple[int, Any, Optional[str]], Tuple[List[int], asyncio.Task]] = {}
 
         intents = options.get('intents', None)
         if intents is not None:
@@ -294,6 +312,69 @@ class ConnectionState:
         self._add_guild(guild)
         return guild
 
+    async def _fill_in_guilds(self, guilds: List[Guild]) -> None:
+        # each fill_in issues several requests at once, so cap how many guilds are in flight
+        semaphore = asyncio.Semaphore(_GUILD_FILL_IN_CONCURRENCY)
+
+        async def fill_in(guild: Guild) -> None:
+            async with semaphore:
+                await guild.fill_in()
+
+        await asyncio.gather(*(fill_in(guild) for guild in guilds))
+
+    async def queue_mute(self, guild_id: int, user_id: int, duration: Any, reason: Optional[str] = None) -> None:
+        # mutes with the same guild, duration and reason that arrive within
+        # _MUTE_BATCH_DELAY of each other are sent as a single request
+        key = (guild_id, duration, reason)
+        batch = self._mute_batches.get(key)
+        # a task cancelled before it started never reaches its cleanup, don't join it
+        if batch is None or batch[1].done():
+            user_ids = [user_id]
+            task = asyncio.create_task(self._flush_mutes(key, user_ids))
+            self._mute_batches[key] = (user_ids, task)
+        else:
+            user_ids, task = batch
+            if user_id not in user_ids:
+                user_ids.append(user_id)
+
+        # one cancelled caller must not cancel the request for the others
+        errors = await asyncio.shield(task)
+        error = errors.get(user_id)
+        if error is not None:
+            raise error
+
+    async def _flush_mutes(
+            self, key: Tuple[int, Any, Optional[str]], user_ids: List[int]
+    ) -> Dict[int, BaseException]:
+        try:
+            await asyncio.sleep(_MUTE_BATCH_DELAY)
+        finally:
+            # also when cancelled, or later mutes would join a dead task
+            self._mute_batches.pop(key, None)
+
+        guild_id, duration, reason = key
+        try:
+            if len(user_ids) == 1:
+                await self.http.mute_member(user_ids[0], guild_id, duration, reason=reason)
+            else:
+                await self.http.mute_members(user_ids, guild_id, duration, reason=reason)
+        except Exception as e:
+            if len(user_ids) == 1 or not _is_member_mute_error(e):
+                # shared by the whole batch, e.g. missing permission, don't ask again per user
+                return {user_id: e for user_id in user_ids}
+        else:
+            return {}
+
+        # one of the members was refused, mute one by one so each caller only gets its own error
+        submit = self.http._submit
+        results = await asyncio.gather(
+            *(submit(self.http.mute_member(user_id, guild_id, duration, reason=reason)) for user_id in user_ids),
+            return_exceptions=True,
+        )
+        return {
+            user_id: result for user_id, result in zip(user_ids, results) if isinstance(result, BaseException)
+        }
+
     def _guild_needs_chunking(self, guild: Guild) -> bool:
         # If presences are enabled then we get back the old guild.large behaviour
         return False
@@ -454,12 +535,7 @@ class ConnectionState:
                 self.application_id = application.get('id')
 
         result = await self.http.get_guilds()
-
-        futures = []
-        for guild_data in result:
-            guild = self._add_guild_from_data(guild_data)
-            futures.append(guild.fill_in())
-        await asyncio.gather(*futures)
+        await self._fill_in_guilds([self._add_guild_from_data(guild_data) for guild_data in result])
 
         self.dispatch('connect')
         self._ready_task = asyncio.create_task(self._delay_ready())
@@ -525,6 +601,7 @@ class ConnectionState:
             if channel is not None:
                 old_channel = copy.copy(channel)
                 channel._update(guild, data)
+                guild._invalidate_channel_cache()
                 self.dispatch('guild_channel_update', old_channel, channel)
             else:
                 _log.debug('CHANNEL_UPDATE 引用了一个未知的子频道 ID：%s。丢弃。', channel_id)
@@ -561,6 +638,8 @@ class ConnectionState:
             guild._member_count += 1
         except (AttributeError, TypeError):
             pass
+        else:
+            guild._update_member_stats()
 
         self.dispatch('member_join', member)
 
@@ -571,6 +650,8 @@ class ConnectionState:
                 guild._member_count -= 1
             except (AttributeError, TypeError):
                 pass
+            else:
+                guild._update_member_stats()
 
             user_id = int(data['user']['id'])
             member = guild.get_member(user_id)
@@ -597,6 +678,7 @@ class ConnectionState:
             if user_update:
                 self.dispatch('user_update', user_update[0], user_update[1])
 
+            guild._index_member(member)
             self.dispatch('member_update', old_member, member)
         else:
             member = Member(data=data, guild=guild, state=self)
@@ -942,10 +1024,7 @@ class AutoShardedConnectionState(ConnectionState):
                 self.application_id = application.get('id')
 
         result = await self.http.get_guilds()
-
-        for guild_data in result:
-            guild = self._add_guild_from_data(guild_data)
-            await guild.fill_in()
+        await self._fill_in_guilds([self._add_guild_from_data(guild_data) for guild_data in result])
 
         if self._messages:
             self._update_message_references()
@@ -323,6 +323,9 @@ if HAS_ORJSON:
         return orjson.dumps(obj).decode('utf-8')
 
 
+    _to_json_bytes = orjson.dumps  # type: ignore
+
+
     _from_json = orjson.loads  # type: ignore
 
 else:
@@ -331,6 +334,10 @@ else:
         return json.dumps(obj, separators=(',', ':'), ensure_ascii=True)
 
 
+    def _to_json_bytes(obj: Any) -> bytes:
+        return _to_json(obj).encode('utf-8')
+
+
     _from_json = json.loads
 
 
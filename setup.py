@@ -38,6 +38,9 @@ extras_require = {
         'sphinxcontrib_trio==1.1.2',
         'sphinxcontrib-websupport',
     ],
+    'speed': [
+        'orjson>=3.5.4',
+    ],
 }
 
 setup(